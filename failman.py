@@ -1,107 +1,228 @@
 import csv
+import json
 import os
+import pickle
 import smtplib
-from collections import defaultdict
-from dataclasses import dataclass
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
 from email import encoders
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from io import StringIO
+from functools import lru_cache
+from html import escape
+from io import BytesIO, TextIOWrapper
+from itertools import groupby
+from operator import attrgetter
+from string import Template
 from typing import Dict, List
 
 import requests
 import yaml
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as _YamlLoader
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:  # orjson is optional
+    _json_loads = json.loads
 
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
-@dataclass
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Parsed config keyed by source, reused while the file (mtime, size) or URL (ETag) is unchanged
+CONFIG_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "failman", "config.pkl")
+# Upper bound on concurrent buildbot requests when fanning out per branch
+MAX_FETCH_WORKERS = 8
+# Changes requested per branch in the aggregate /changes call; branches whose
+# latest change falls outside that window are fetched individually
+AGGREGATE_CHANGES_PER_BRANCH = 5
+# (connect, read) timeout in seconds for every HTTP request
+HTTP_TIMEOUT = (3.05, 15)
+# Timeout in seconds for the SMTP relay connection
+SMTP_TIMEOUT = 30
+
+
+def _make_session() -> requests.Session:
+    """
+    Shared session so requests to the buildbot host reuse pooled keep-alive connections.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        # Keep one connection alive per fan-out worker so none is discarded after use
+        pool_maxsize=MAX_FETCH_WORKERS,
+        # Transparently retry transient buildbot failures instead of aborting the report
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=["GET"],
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+SESSION = _make_session()
+
+# Lowercased build states that are not reported as failures
+_ACTIVE_OR_OK = frozenset({"acquiring locks", "building", "build successful", "preparing worker"})
+
+# HTML report fragments; the separator is a Gmail-friendly horizontal line with padding
+_SEP = "<hr style='border:none;border-top:1px solid #ccc;margin:20px 0;'>"
+_TABLE_OPEN = "<table border='1' cellpadding='4' cellspacing='0' style='border-collapse:collapse'>"
+_TABLE_CLOSE = "</table>"
+_HEADER_ROW = "<tr><th>Build</th><th>Commit</th><th>Status</th></tr>"
+_ROW_TPL = Template('<tr><td><a href="$url">$name</a></td><td>$commit</td><td>$status</td></tr>')
+
+# CSV report columns, read from a Build as one tuple
+_CSV_HEADER = ("Branch", "Build", "Commit", "Status", "URL")
+_csv_row = attrgetter("branch", "name", "commit", "status", "url")
+
+@dataclass(slots=True)
 class Build:
     name: str
     url: str
     commit: str
     branch: str
     status: str
+    # Lowercased copies used by sorting and failure filtering
+    _name_lc: str = field(init=False, repr=False, compare=False)
+    _status_lc: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self._name_lc = self.name.lower()
+        # A build without a state string is reported as failed; the HTML and CSV
+        # renderers show the missing status as an empty cell
+        self._status_lc = (self.status or "").lower()
+
+
+def _read_config_cache() -> dict:
+    # A cache file truncated or corrupted in any way (pickle can raise almost
+    # anything on bad input) is treated as a miss
+    try:
+        with open(CONFIG_CACHE_PATH, "rb") as file:
+            cache = pickle.load(file)
+    except Exception:
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _write_config_cache(cache: dict) -> None:
+    # The cache is an optimization only, never fail the run because of it.
+    # Write to a temp file and rename it so overlapping runs never see a partial file.
+    cache_dir = os.path.dirname(CONFIG_CACHE_PATH)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".config-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                pickle.dump(cache, file)
+            os.replace(tmp_path, CONFIG_CACHE_PATH)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except (OSError, pickle.PicklingError):
+        pass
 
 
 def load_config(config_path_or_url):
+    cache = _read_config_cache()
     if config_path_or_url.startswith("http://") or config_path_or_url.startswith("https://"):
-        resp = requests.get(config_path_or_url)
+        cached = cache.get(config_path_or_url)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        resp = SESSION.get(config_path_or_url, headers=headers, timeout=HTTP_TIMEOUT)
+        if cached and resp.status_code == 304:
+            return cached[1]
         resp.raise_for_status()
-        config = yaml.safe_load(resp.text)
+        config = yaml.load(resp.text, Loader=_YamlLoader)
+        etag = resp.headers.get("ETag")
+        if etag:
+            cache[config_path_or_url] = (etag, config)
+            _write_config_cache(cache)
     else:
+        st = os.stat(config_path_or_url)
+        key = (st.st_mtime_ns, st.st_size)
+        cached = cache.get(config_path_or_url)
+        if cached and cached[0] == key:
+            return cached[1]
         with open(config_path_or_url, "r") as file:
-            config = yaml.safe_load(file)
+            config = yaml.load(file, Loader=_YamlLoader)
+        cache[config_path_or_url] = (key, config)
+        _write_config_cache(cache)
     return config
 
-def builds_to_csv(builds: List[Build]) -> str:
+def builds_to_csv(builds: List[Build]) -> bytes:
     """
-    Generate a CSV string from Build objects.
+    Generate UTF-8 encoded CSV bytes from Build objects.
     """
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Branch", "Build", "Commit", "Status", "URL"])
-    for b in builds:
-        writer.writerow([b.branch, b.name, b.commit, b.status, b.url])
+    output = BytesIO()
+    text = TextIOWrapper(output, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text)
+    writer.writerow(_CSV_HEADER)
+    writer.writerows(map(_csv_row, builds))
+    text.flush()
     return output.getvalue()
 
 
-def builds_to_html_table(builds: List[Build]) -> str:
-    # Group builds by branch
-    grouped: Dict[str, List[Build]] = defaultdict(list)
-    for b in builds:
-        grouped[b.branch].append(b)
+def _escape(value) -> str:
+    # Buildbot may return null fields (e.g. a sourcestamp without revision)
+    return "" if value is None else escape(str(value))
+
+
+def _row(b: Build) -> str:
+    return _ROW_TPL.substitute(
+        url=_escape(b.url), name=_escape(b.name), commit=_escape(b.commit), status=_escape(b.status)
+    )
+
 
-    # Separator — Gmail-friendly horizontal line with padding
-    separator = "<hr style='border:none;border-top:1px solid #ccc;margin:20px 0;'>"
+@lru_cache(maxsize=None)
+def _branch_key(branch: str):
+    """
+    Sort key ordering version branches numerically (10.11 after 10.9),
+    other branch names after all versions.
+    """
+    try:
+        return (0, tuple(int(part) for part in branch.split(".")))
+    except ValueError:
+        return (1, branch)
+
+
+def builds_to_html_table(builds: List[Build]) -> str:
+    # Single sort by branch, then by name inside the branch, and group by branch
+    builds_sorted = sorted(builds, key=lambda b: (_branch_key(b.branch), b._name_lc))
+    grouped = [(branch, list(group)) for branch, group in groupby(builds_sorted, key=attrgetter("branch"))]
 
     html_parts = []
 
-    # Sort branches descending
-    for branch in sorted(grouped.keys(), reverse=True):
-        builds_in_branch = grouped[branch]
-
-        # Branch header
-        html_parts.append(f"<h3>Branch: {branch}</h3>")
-        html_parts.append(separator)
-
-        # Sort builds by name ascending inside the branch
-        builds_in_branch_sorted = sorted(builds_in_branch, key=lambda b: b.name.lower())
-
-        # Build table for this branch
-        rows = ["<tr><th>Build</th><th>Commit</th><th>Status</th></tr>"]
-        for b in builds_in_branch_sorted:
-            hyperlink = f'<a href="{b.url}">{b.name}</a>'
-            rows.append(
-                f"<tr>"
-                f"<td>{hyperlink}</td>"
-                f"<td>{b.commit}</td>"
-                f"<td>{b.status}</td>"
-                f"</tr>"
-            )
-        table_html = f"<table border='1' cellpadding='4' cellspacing='0' style='border-collapse:collapse'>{''.join(rows)}</table>"
-        html_parts.append(table_html)
+    # Branches descending, builds keep their ascending name order
+    for branch, builds_in_branch in reversed(grouped):
+        rows = "".join(_row(b) for b in builds_in_branch)
 
-        # Separator after table
-        html_parts.append(separator)
+        # Branch header, table for this branch and separator after it
+        html_parts.append(
+            f"<h3>Branch: {_escape(branch)}</h3>\n{_SEP}\n"
+            f"{_TABLE_OPEN}{_HEADER_ROW}{rows}{_TABLE_CLOSE}\n{_SEP}"
+        )
 
     return "\n".join(html_parts)
 
 
-def send_email_with_csv(
+def _build_message(
     sender_email: str,
     recipient_email: str,
     subject: str,
     html_body: str,
-    csv_content: str,
-    smtp_relay: str,
-    smtp_port: int
-) -> None:
-    """
-    Send an HTML email via Gmail with a CSV attachment.
-    """
+    csv_content: bytes,
+) -> MIMEMultipart:
     msg = MIMEMultipart("mixed")
     msg["From"] = sender_email
     msg["To"] = recipient_email
@@ -114,49 +235,173 @@ def send_email_with_csv(
 
     # Attach CSV
     part = MIMEBase("application", "octet-stream")
-    part.set_payload(csv_content.encode("utf-8"))
+    part.set_payload(csv_content)
     encoders.encode_base64(part)
     part.add_header("Content-Disposition", 'attachment; filename="builds_report.csv"')
     msg.attach(part)
+    return msg
+
+
+def _send(smtp: smtplib.SMTP, msg: MIMEMultipart) -> None:
+    # No login, IP-based authentication handled by Google
+    smtp.sendmail(msg["From"], msg["To"], msg.as_string())
+
+
+def _close_smtp(smtp_future: Future) -> None:
+    if smtp_future.exception() is None:
+        smtp_future.result().close()
+
+
+def send_email_with_csv(
+    sender_email: str,
+    recipient_email: str,
+    subject: str,
+    html_body: str,
+    csv_content: bytes,
+    smtp_relay: str,
+    smtp_port: int
+) -> None:
+    """
+    Send an HTML email via Gmail with a CSV attachment.
+    """
+    msg = _build_message(sender_email, recipient_email, subject, html_body, csv_content)
+    with smtplib.SMTP_SSL(smtp_relay, smtp_port, timeout=SMTP_TIMEOUT) as smtp:
+        _send(smtp, msg)
+
+
+def send_report(
+    sender_email: str,
+    recipient_email: str,
+    subject: str,
+    builds: List[Build],
+    smtp_relay: str,
+    smtp_port: int,
+) -> None:
+    """
+    Render the HTML and CSV report for `builds` and email it, opening the
+    SMTP relay connection in the background while the report is rendered.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        smtp_future = executor.submit(smtplib.SMTP_SSL, smtp_relay, smtp_port, timeout=SMTP_TIMEOUT)
+        try:
+            msg = _build_message(
+                sender_email, recipient_email, subject, builds_to_html_table(builds), builds_to_csv(builds)
+            )
+        except BaseException:
+            # Don't leak the connection opened in the background
+            smtp_future.add_done_callback(_close_smtp)
+            raise
+        with smtp_future.result() as smtp:
+            _send(smtp, msg)
+
+
+def send_many(
+    sender_email: str,
+    subject: str,
+    builds_per_recipient: Dict[str, List[Build]],
+    smtp_relay: str,
+    smtp_port: int,
+) -> None:
+    """
+    Send one report per recipient over a single SMTP connection.
+    """
+    with smtplib.SMTP_SSL(smtp_relay, smtp_port, timeout=SMTP_TIMEOUT) as smtp:
+        for i, (recipient_email, builds) in enumerate(builds_per_recipient.items()):
+            if i:
+                smtp.rset()
+            _send(
+                smtp,
+                _build_message(
+                    sender_email, recipient_email, subject, builds_to_html_table(builds), builds_to_csv(builds)
+                ),
+            )
 
-    with smtplib.SMTP_SSL(smtp_relay, smtp_port) as smtp:
-        # No login, IP-based authentication handled by Google
-        smtp.sendmail(sender_email, recipient_email, msg.as_string())
 
-def get_builders_details(api_url):
+def get_builders_details(api_url, name_filter=None):
     url = f"{api_url}/builders"
-    response = requests.get(url)
-    data = response.json()
-    filtered = [b for b in data.get("builders", [])]
+    names = set(name_filter or [])
+    if names:
+        # A list is sent as repeated name__in parameters
+        response = SESSION.get(url, params={"name__in": sorted(names)}, timeout=HTTP_TIMEOUT)
+        if response.ok:
+            filtered = [b for b in _json_loads(response.content).get("builders", []) if b["name"] in names]
+            # Any match proves the filter was applied; names left out don't exist on the server
+            if filtered:
+                return filtered
+        # Server rejected or misread the filter; fetch all builders and filter them below
+    response = SESSION.get(url, timeout=HTTP_TIMEOUT)
+    data = _json_loads(response.content)
+    filtered = [b for b in data.get("builders", []) if not names or b["name"] in names]
     return filtered
 
 
 def get_latest_builds_on_branch(branch, api_url):
     url = f"{api_url}/changes?branch={branch}&limit=1&order=-changeid"
-    response = requests.get(url)
-    data = response.json()
+    response = SESSION.get(url, timeout=HTTP_TIMEOUT)
+    data = _json_loads(response.content)
     changes = data.get("changes", [])
     return changes
 
 
+def _fetch_latest_changes_per_branch(branches, api_url):
+    # Only pay for worker threads when there is more than one request in flight
+    if len(branches) <= 1:
+        return {br: get_latest_builds_on_branch(br, api_url) for br in branches}
+    with ThreadPoolExecutor(max_workers=min(MAX_FETCH_WORKERS, len(branches))) as executor:
+        return dict(executor.map(lambda br: (br, get_latest_builds_on_branch(br, api_url)), branches))
+
+
+def get_latest_changes(branches, api_url):
+    """
+    Fetch the latest change of every branch with a single aggregate /changes call,
+    falling back to concurrent per-branch calls for branches it did not cover.
+    Returns (branch, changes) tuples in the order of `branches`.
+    """
+    branches = [str(br) for br in branches]
+    if not branches:
+        return []
+    latest = {}
+    try:
+        response = SESSION.get(
+            f"{api_url}/changes",
+            params={
+                # A list is sent as repeated branch__in parameters
+                "branch__in": branches,
+                "limit": len(branches) * AGGREGATE_CHANGES_PER_BRANCH,
+                "order": "-changeid",
+            },
+            timeout=HTTP_TIMEOUT,
+        )
+        response.raise_for_status()
+        wanted = set(branches)
+        # Changes come newest first, so the first one seen per branch is the latest
+        for change in _json_loads(response.content).get("changes", []):
+            branch = (change.get("sourcestamp") or {}).get("branch")
+            if branch in wanted and branch not in latest:
+                latest[branch] = [change]
+    except (requests.RequestException, ValueError):
+        pass
+
+    missing = [br for br in branches if br not in latest]
+    latest.update(_fetch_latest_changes_per_branch(missing, api_url))
+    return [(br, latest[br]) for br in branches]
+
+
 def join_builders_with_change(builders, builds, branch, revision, buildbot_url):
     build_map = {b["builderid"]: b for b in builds}
-    builds = []
-    for builder in builders:
-        builderid = builder["builderid"]
-        build_data = build_map.get(builderid)
-
-        if build_data:
-            builds.append(
-                Build(
-                    name=builder["name"],
-                    branch=branch,
-                    commit=revision,
-                    url=f"{buildbot_url}#/builders/{builder['builderid']}/builds/{build_data.get('number')}",
-                    status=build_data.get("state_string"),
-                )
-            )
-    return builds
+    build_map_get = build_map.get
+    return [
+        Build(
+            name=builder["name"],
+            branch=branch,
+            commit=revision,
+            url=f"{buildbot_url}#/builders/{builder['builderid']}/builds/{build_data.get('number')}",
+            status=build_data.get("state_string"),
+        )
+        for builder in builders
+        for build_data in (build_map_get(builder["builderid"]),)
+        if build_data
+    ]
 
 
 if __name__ == "__main__":
@@ -174,12 +419,9 @@ if __name__ == "__main__":
     smtp_port = int(os.getenv("SMTP_RELAY_PORT"))
 
     BUILDS = []
-    builders = get_builders_details(api_url)
-    filtered_builders = set(config["configuration"].get("builder_filter") or [])
-    builders = [builder for builder in builders if not filtered_builders or builder["name"] in filtered_builders]
+    builders = get_builders_details(api_url, name_filter=config["configuration"].get("builder_filter"))
 
-    for branch in config["configuration"]["branches"]:
-        changes = get_latest_builds_on_branch(branch, api_url)
+    for branch, changes in get_latest_changes(config["configuration"]["branches"], api_url):
         if changes:
             builds = join_builders_with_change(
                 builders,
@@ -189,17 +431,9 @@ if __name__ == "__main__":
                 buildbot_url=buildbot_url,
             )
             BUILDS.extend(builds)
-    failed_builds = [
-        b
-        for b in BUILDS
-        if b.status.lower() not in ["acquiring locks", "building", "build successful", "preparing worker"]
-    ]
+    failed_builds = [b for b in BUILDS if b._status_lc not in _ACTIVE_OR_OK]
 
     if failed_builds:
-        html_content = builds_to_html_table(failed_builds)
-        csv_content = builds_to_csv(failed_builds)
-        send_email_with_csv(
-            sender, recipient, subject, html_content, csv_content, smtp_relay, smtp_port
-        )
+        send_report(sender, recipient, subject, failed_builds, smtp_relay, smtp_port)
     else:
         print("Grab a coffee and enjoy a bug free world!")
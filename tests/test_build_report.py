@@ -1,4 +1,5 @@
 import io
+import json
 import os
 import builtins
 import pytest
@@ -13,12 +14,18 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from failman import (  # replace with actual module name, e.g. build_report
     Build,
+    HTTP_TIMEOUT,
+    _ACTIVE_OR_OK,
+    SESSION,
     load_config,
     builds_to_csv,
     builds_to_html_table,
     send_email_with_csv,
+    send_many,
+    send_report,
     get_builders_details,
     get_latest_builds_on_branch,
+    get_latest_changes,
     join_builders_with_change,
 )
 
@@ -35,6 +42,13 @@ def sample_builds():
 # load_config
 # -----------------------
 
+@pytest.fixture(autouse=True)
+def config_cache(tmp_path, monkeypatch):
+    cache_path = tmp_path / "cache" / "config.pkl"
+    monkeypatch.setattr("failman.CONFIG_CACHE_PATH", str(cache_path))
+    return cache_path
+
+
 def test_load_config_from_file(tmp_path):
     data = {"a": 1, "b": 2}
     yaml_path = tmp_path / "config.yaml"
@@ -43,16 +57,59 @@ def test_load_config_from_file(tmp_path):
     assert result == data
 
 
-@patch("requests.get")
+def test_load_config_from_file_uses_cache(tmp_path, config_cache):
+    yaml_path = tmp_path / "config.yaml"
+    yaml_path.write_text(yaml.dump({"a": 1}))
+    assert load_config(str(yaml_path)) == {"a": 1}
+    assert config_cache.exists()
+
+    with patch("failman.yaml.load") as mock_load:
+        assert load_config(str(yaml_path)) == {"a": 1}
+    mock_load.assert_not_called()
+
+    # A changed file invalidates the cached entry
+    yaml_path.write_text(yaml.dump({"a": 1, "b": 2}))
+    assert load_config(str(yaml_path)) == {"a": 1, "b": 2}
+
+
+def test_load_config_ignores_corrupt_cache(tmp_path, config_cache):
+    config_cache.parent.mkdir(parents=True)
+    config_cache.write_bytes(b"\x80\x09")  # raises ValueError, not UnpicklingError
+    yaml_path = tmp_path / "config.yaml"
+    yaml_path.write_text(yaml.dump({"a": 1}))
+    assert load_config(str(yaml_path)) == {"a": 1}
+    # The corrupt file is atomically replaced, leaving no temp files behind
+    assert [p.name for p in config_cache.parent.iterdir()] == ["config.pkl"]
+    assert load_config(str(yaml_path)) == {"a": 1}
+
+
+@patch("failman.SESSION.get")
 def test_load_config_from_url(mock_get):
     fake_yaml = yaml.dump({"x": 10})
     mock_get.return_value.status_code = 200
     mock_get.return_value.text = fake_yaml
+    mock_get.return_value.headers = {}
     mock_get.return_value.raise_for_status = lambda: None
 
     result = load_config("https://example.com/config.yaml")
     assert result == {"x": 10}
-    mock_get.assert_called_once_with("https://example.com/config.yaml")
+    mock_get.assert_called_once_with("https://example.com/config.yaml", headers={}, timeout=HTTP_TIMEOUT)
+
+
+@patch("failman.SESSION.get")
+def test_load_config_from_url_not_modified(mock_get):
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.text = yaml.dump({"x": 10})
+    mock_get.return_value.headers = {"ETag": '"v1"'}
+    mock_get.return_value.raise_for_status = lambda: None
+    assert load_config("https://example.com/config.yaml") == {"x": 10}
+
+    mock_get.return_value.status_code = 304
+    mock_get.return_value.text = ""
+    assert load_config("https://example.com/config.yaml") == {"x": 10}
+    mock_get.assert_called_with(
+        "https://example.com/config.yaml", headers={"If-None-Match": '"v1"'}, timeout=HTTP_TIMEOUT
+    )
 
 
 # -----------------------
@@ -61,10 +118,11 @@ def test_load_config_from_url(mock_get):
 
 def test_builds_to_csv(sample_builds):
     csv_output = builds_to_csv(sample_builds)
-    assert "Branch,Build,Commit,Status,URL" in csv_output
-    assert "main" in csv_output
-    assert "dev" in csv_output
-    assert csv_output.count("\n") == 3  # header + 2 rows
+    assert isinstance(csv_output, bytes)
+    assert b"Branch,Build,Commit,Status,URL" in csv_output
+    assert b"main" in csv_output
+    assert b"dev" in csv_output
+    assert csv_output.count(b"\n") == 3  # header + 2 rows
 
 
 # -----------------------
@@ -81,6 +139,49 @@ def test_builds_to_html_table_groups_by_branch(sample_builds):
     assert '<a href="http://example.com/A">build-A</a>' in html
 
 
+def test_builds_to_html_table_orders_branches_and_builds():
+    builds = [
+        Build(name="b-2", url="u1", commit="c", branch="main", status="failed"),
+        Build(name="A-1", url="u2", commit="c", branch="dev", status="failed"),
+        Build(name="a-3", url="u3", commit="c", branch="main", status="failed"),
+    ]
+    html = builds_to_html_table(builds)
+    assert html.index("Branch: main") < html.index("Branch: dev")
+    assert html.index(">a-3<") < html.index(">b-2<") < html.index("Branch: dev")
+
+
+def test_builds_to_html_table_orders_version_branches():
+    builds = [
+        Build(name="b", url="u", commit="c", branch=branch, status="failed")
+        for branch in ["10.9", "main", "10.11", "9.1"]
+    ]
+    html = builds_to_html_table(builds)
+    positions = [html.index(f"Branch: {branch}<") for branch in ["main", "10.11", "10.9", "9.1"]]
+    assert positions == sorted(positions)
+
+
+def test_builds_to_html_table_none_commit():
+    build = Build(name="B1", url="http://example.com/1", commit=None, branch="main", status="failed")
+    html = builds_to_html_table([build])
+    assert '<a href="http://example.com/1">B1</a></td><td></td><td>failed</td>' in html
+
+
+def test_build_without_status_is_reported():
+    build = Build(name="B1", url="http://example.com/1", commit="abc", branch="main", status=None)
+    assert build._status_lc not in _ACTIVE_OR_OK
+    assert "<td>abc</td><td></td></tr>" in builds_to_html_table([build])
+    assert builds_to_csv([build]).splitlines()[1] == b"main,B1,abc,,http://example.com/1"
+
+
+def test_builds_to_html_table_escapes_fields():
+    build = Build(
+        name="<b>x</b>", url='http://example.com/?a=1&b="2"', commit="abc", branch="main", status="failed & retried"
+    )
+    html = builds_to_html_table([build])
+    assert '<a href="http://example.com/?a=1&amp;b=&quot;2&quot;">&lt;b&gt;x&lt;/b&gt;</a>' in html
+    assert "<td>failed &amp; retried</td>" in html
+
+
 # -----------------------
 # send_email_with_csv
 # -----------------------
@@ -93,7 +194,7 @@ def test_send_email_with_csv(mock_smtp):
         recipient_email="b@example.com",
         subject="Test",
         html_body="<p>Hello</p>",
-        csv_content="x,y,z",
+        csv_content=b"x,y,z",
         smtp_relay="smtp.example.com",
         smtp_port=465,
     )
@@ -104,36 +205,213 @@ def test_send_email_with_csv(mock_smtp):
     assert "Content-Type: multipart/mixed" in args[2]
 
 
+@patch("smtplib.SMTP_SSL")
+def test_send_report(mock_smtp, sample_builds):
+    smtp_instance = mock_smtp.return_value.__enter__.return_value
+    send_report("a@example.com", "b@example.com", "Test", sample_builds, "smtp.example.com", 465)
+    mock_smtp.assert_called_once()
+    smtp_instance.sendmail.assert_called_once()
+    args, kwargs = smtp_instance.sendmail.call_args
+    assert args[:2] == ("a@example.com", "b@example.com")
+    assert "builds_report.csv" in args[2]
+
+
+@patch("failman.builds_to_html_table", side_effect=RuntimeError("render failed"))
+@patch("smtplib.SMTP_SSL")
+def test_send_report_closes_connection_on_render_error(mock_smtp, mock_render, sample_builds):
+    with pytest.raises(RuntimeError):
+        send_report("a@example.com", "b@example.com", "Test", sample_builds, "smtp.example.com", 465)
+    mock_smtp.return_value.close.assert_called_once()
+    mock_smtp.return_value.sendmail.assert_not_called()
+
+
+@patch("smtplib.SMTP_SSL")
+def test_send_many_single_connection(mock_smtp, sample_builds):
+    smtp_instance = mock_smtp.return_value.__enter__.return_value
+    send_many(
+        sender_email="a@example.com",
+        subject="Test",
+        builds_per_recipient={"b@example.com": sample_builds, "c@example.com": sample_builds[:1]},
+        smtp_relay="smtp.example.com",
+        smtp_port=465,
+    )
+    mock_smtp.assert_called_once()
+    assert smtp_instance.sendmail.call_count == 2
+    smtp_instance.rset.assert_called_once()
+    assert smtp_instance.sendmail.call_args_list[1][0][1] == "c@example.com"
+
+
+# -----------------------
+# SESSION
+# -----------------------
+
+@pytest.mark.parametrize("scheme", ["http://", "https://"])
+def test_session_retries_transient_get_failures(scheme):
+    retries = SESSION.get_adapter(scheme + "buildbot.example.com").max_retries
+    assert retries.total == 3
+    assert set(retries.status_forcelist) == {502, 503, 504}
+    assert list(retries.allowed_methods) == ["GET"]
+
+
 # -----------------------
 # get_builders_details
 # -----------------------
 
-@patch("requests.get")
+@patch("failman.SESSION.get")
 def test_get_builders_details(mock_get):
-    mock_get.return_value.json.return_value = {
-        "builders": [{"builderid": 1, "name": "B1"}]
-    }
+    mock_get.return_value.content = json.dumps(
+        {"builders": [{"builderid": 1, "name": "B1"}]}
+    ).encode()
     result = get_builders_details("http://api.example.com")
-    mock_get.assert_called_once_with("http://api.example.com/builders")
+    mock_get.assert_called_once_with("http://api.example.com/builders", timeout=HTTP_TIMEOUT)
     assert result == [{"builderid": 1, "name": "B1"}]
 
 
+@patch("failman.SESSION.get")
+def test_get_builders_details_filters_server_side(mock_get):
+    mock_get.return_value.ok = True
+    mock_get.return_value.content = json.dumps(
+        {"builders": [{"builderid": 2, "name": "B2"}]}
+    ).encode()
+    result = get_builders_details("http://api.example.com", name_filter=["B2"])
+    mock_get.assert_called_once_with(
+        "http://api.example.com/builders", params={"name__in": ["B2"]}, timeout=HTTP_TIMEOUT
+    )
+    assert result == [{"builderid": 2, "name": "B2"}]
+
+
+@patch("failman.SESSION.get")
+def test_get_builders_details_filter_rejected(mock_get):
+    rejected = MagicMock(ok=False)
+    unfiltered = MagicMock(ok=True)
+    unfiltered.content = json.dumps(
+        {"builders": [{"builderid": 1, "name": "B1"}, {"builderid": 2, "name": "B2"}]}
+    ).encode()
+    mock_get.side_effect = [rejected, unfiltered]
+    result = get_builders_details("http://api.example.com", name_filter=["B2"])
+    assert mock_get.call_count == 2
+    mock_get.assert_called_with("http://api.example.com/builders", timeout=HTTP_TIMEOUT)
+    assert result == [{"builderid": 2, "name": "B2"}]
+
+
+@patch("failman.SESSION.get")
+def test_get_builders_details_filter_partial_match(mock_get):
+    mock_get.return_value.ok = True
+    mock_get.return_value.content = json.dumps(
+        {"builders": [{"builderid": 1, "name": "B1"}]}
+    ).encode()
+    result = get_builders_details("http://api.example.com", name_filter=["B1", "retired"])
+    mock_get.assert_called_once_with(
+        "http://api.example.com/builders", params={"name__in": ["B1", "retired"]}, timeout=HTTP_TIMEOUT
+    )
+    assert result == [{"builderid": 1, "name": "B1"}]
+
+
+@patch("failman.SESSION.get")
+def test_get_builders_details_filter_returns_nothing(mock_get):
+    # Server accepts name__in but matches nothing
+    empty = MagicMock(ok=True)
+    empty.content = json.dumps({"builders": []}).encode()
+    unfiltered = MagicMock(ok=True)
+    unfiltered.content = json.dumps(
+        {"builders": [{"builderid": 1, "name": "B1"}, {"builderid": 2, "name": "B2"}, {"builderid": 3, "name": "B3"}]}
+    ).encode()
+    mock_get.side_effect = [empty, unfiltered]
+    result = get_builders_details("http://api.example.com", name_filter=["B1", "B2"])
+    assert mock_get.call_count == 2
+    mock_get.assert_called_with("http://api.example.com/builders", timeout=HTTP_TIMEOUT)
+    assert result == [{"builderid": 1, "name": "B1"}, {"builderid": 2, "name": "B2"}]
+
+
 # -----------------------
 # get_latest_builds_on_branch
 # -----------------------
 
-@patch("requests.get")
+@patch("failman.SESSION.get")
 def test_get_latest_builds_on_branch(mock_get):
-    mock_get.return_value.json.return_value = {
-        "changes": [{"sourcestamp": {"branch": "main"}}]
-    }
+    mock_get.return_value.content = json.dumps(
+        {"changes": [{"sourcestamp": {"branch": "main"}}]}
+    ).encode()
     result = get_latest_builds_on_branch("main", "http://api.example.com")
     mock_get.assert_called_once_with(
-        "http://api.example.com/changes?branch=main&limit=1&order=-changeid"
+        "http://api.example.com/changes?branch=main&limit=1&order=-changeid",
+        timeout=HTTP_TIMEOUT,
     )
     assert result[0]["sourcestamp"]["branch"] == "main"
 
 
+# -----------------------
+# get_latest_changes
+# -----------------------
+
+@patch("failman.get_latest_builds_on_branch")
+@patch("failman.SESSION.get")
+def test_get_latest_changes_single_aggregate_call(mock_get, mock_latest):
+    mock_get.return_value.content = json.dumps({
+        "changes": [
+            {"changeid": 3, "sourcestamp": {"branch": "main"}},
+            {"changeid": 2, "sourcestamp": {"branch": "11.4"}},
+            {"changeid": 1, "sourcestamp": {"branch": "main"}},
+        ]
+    }).encode()
+    result = get_latest_changes(["main", 11.4], "http://api.example.com")
+    assert result == [
+        ("main", [{"changeid": 3, "sourcestamp": {"branch": "main"}}]),
+        ("11.4", [{"changeid": 2, "sourcestamp": {"branch": "11.4"}}]),
+    ]
+    mock_get.assert_called_once()
+    args, kwargs = mock_get.call_args
+    assert args == ("http://api.example.com/changes",)
+    assert kwargs["params"]["branch__in"] == ["main", "11.4"]
+    mock_latest.assert_not_called()
+
+
+@patch("failman.get_latest_builds_on_branch")
+@patch("failman.SESSION.get")
+def test_get_latest_changes_skips_null_sourcestamp(mock_get, mock_latest):
+    mock_get.return_value.content = json.dumps({
+        "changes": [
+            {"changeid": 3, "sourcestamp": None},
+            {"changeid": 2, "sourcestamp": {"branch": "main"}},
+        ]
+    }).encode()
+    result = get_latest_changes(["main"], "http://api.example.com")
+    assert result == [("main", [{"changeid": 2, "sourcestamp": {"branch": "main"}}])]
+    mock_latest.assert_not_called()
+
+
+@patch("failman.get_latest_builds_on_branch")
+@patch("failman.SESSION.get")
+def test_get_latest_changes_falls_back_per_branch(mock_get, mock_latest):
+    mock_get.return_value.raise_for_status.side_effect = requests.HTTPError("400")
+    mock_latest.side_effect = lambda branch, api_url: [{"branch": branch}]
+    result = get_latest_changes(["10.6", "11.4", "main"], "http://api.example.com")
+    assert result == [
+        ("10.6", [{"branch": "10.6"}]),
+        ("11.4", [{"branch": "11.4"}]),
+        ("main", [{"branch": "main"}]),
+    ]
+    assert mock_latest.call_count == 3
+
+
+@patch("failman.ThreadPoolExecutor")
+@patch("failman.get_latest_builds_on_branch")
+@patch("failman.SESSION.get")
+def test_get_latest_changes_single_missing_branch_inline(mock_get, mock_latest, mock_executor):
+    mock_get.return_value.content = json.dumps(
+        {"changes": [{"changeid": 2, "sourcestamp": {"branch": "main"}}]}
+    ).encode()
+    mock_latest.return_value = [{"changeid": 1, "sourcestamp": {"branch": "10.6"}}]
+    result = get_latest_changes(["main", "10.6"], "http://api.example.com")
+    assert result[1] == ("10.6", [{"changeid": 1, "sourcestamp": {"branch": "10.6"}}])
+    mock_latest.assert_called_once_with("10.6", "http://api.example.com")
+    mock_executor.assert_not_called()
+
+
+def test_get_latest_changes_no_branches():
+    assert get_latest_changes([], "http://api.example.com") == []
+
+
 # -----------------------
 # join_builders_with_change
 # -----------------------